@@ -4,18 +4,53 @@ from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 # Import Pydantic for data validation and settings management
 from pydantic import BaseModel
-# Import OpenAI client for interacting with OpenAI's API
-from openai import OpenAI
+# Import the async OpenAI client so streaming doesn't block the event loop
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
 import os
+import time
+import asyncio
 import logging
+from contextlib import asynccontextmanager
 from typing import Optional
 
 # Configure logging for better debugging on Vercel
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Streamed tokens are buffered and flushed once this many characters have
+# accumulated or this many seconds have passed since the last flush, so we
+# don't send one tiny HTTP chunk per token
+STREAM_FLUSH_CHARS = int(os.getenv("STREAM_FLUSH_CHARS", "64"))
+STREAM_FLUSH_INTERVAL = float(os.getenv("STREAM_FLUSH_INTERVAL", "0.03"))
+
+# Longest user message we'll forward to OpenAI, checked before any API call
+MAX_USER_MESSAGE_CHARS = int(os.getenv("MAX_USER_MESSAGE_CHARS", "8000"))
+
+# Explicitly set the base URL for project keys
+OPENAI_BASE_URL = "https://api.openai.com/v1"
+
+# Open one HTTP connection pool for OpenAI when the app starts and close it on
+# shutdown, so connections to OpenAI can be reused across requests
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    app.state.http_client = DefaultAsyncHttpxClient()
+    app.state.http_client_loop = asyncio.get_running_loop()
+    try:
+        yield
+    finally:
+        await app.state.http_client.aclose()
+
 # Initialize FastAPI application with a title
-app = FastAPI(title="OpenAI Chat API")
+app = FastAPI(title="OpenAI Chat API", lifespan=lifespan)
+
+# Return the shared connection pool, or None if it can't be used here. Its
+# connections belong to the event loop that opened them, so it is skipped when
+# the lifespan didn't run or the request is served on a different loop
+def get_shared_http_client():
+    http_client = getattr(app.state, "http_client", None)
+    if http_client is None or app.state.http_client_loop is not asyncio.get_running_loop():
+        return None
+    return http_client
 
 # Configure CORS (Cross-Origin Resource Sharing) middleware
 # This allows the API to be accessed from different domains/origins
@@ -38,20 +73,38 @@ class ChatRequest(BaseModel):
 # Define the main chat endpoint that handles POST requests
 @app.post("/api/chat")
 async def chat(request: ChatRequest):
+    # Reject empty or oversized messages before spending an OpenAI call on them
+    if not request.user_message.strip():
+        raise HTTPException(status_code=400, detail="user_message must not be empty")
+    if len(request.user_message) > MAX_USER_MESSAGE_CHARS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"user_message must be at most {MAX_USER_MESSAGE_CHARS} characters"
+        )
+
     try:
         logger.info(f"Received chat request with model: {request.model}")
         
-        # Initialize OpenAI client with the provided API key
-        client = OpenAI(
+        # Initialize OpenAI client with the provided API key, on the shared
+        # connection pool when there is one for this event loop
+        shared_http_client = get_shared_http_client()
+        client = AsyncOpenAI(
             api_key=request.api_key,
-            base_url="https://api.openai.com/v1"  # Explicitly set the base URL for project keys
+            base_url=OPENAI_BASE_URL,
+            http_client=shared_http_client
         )
         
         # Create an async generator function for streaming responses
         async def generate():
+            buffer = []
+            buffered_chars = 0
+            sent_text = False
+            last_flush = time.monotonic()
+            stream = None
+            next_chunk = None
             try:
                 # Create a streaming chat completion request
-                stream = client.chat.completions.create(
+                stream = await client.chat.completions.create(
                     model=request.model,
                     messages=[
                         {"role": "developer", "content": request.developer_message},
@@ -59,14 +112,57 @@ async def chat(request: ChatRequest):
                     ],
                     stream=True  # Enable streaming response
                 )
-                
-                # Yield each chunk of the response as it becomes available
-                for chunk in stream:
-                    if chunk.choices[0].delta.content is not None:
-                        yield chunk.choices[0].delta.content
+                chunks = aiter(stream)
+
+                # Batch tokens and yield them once enough text has built up, or
+                # once the flush interval passes, even if the model is pausing
+                while True:
+                    if next_chunk is None:
+                        next_chunk = asyncio.ensure_future(anext(chunks, None))
+                    timeout = None
+                    if buffer:
+                        timeout = max(0.0, STREAM_FLUSH_INTERVAL - (time.monotonic() - last_flush))
+                    done, _ = await asyncio.wait({next_chunk}, timeout=timeout)
+
+                    if done:
+                        chunk = next_chunk.result()
+                        next_chunk = None
+                        if chunk is None:
+                            break
+                        content = chunk.choices[0].delta.content
+                        if content is None:
+                            continue
+                        buffer.append(content)
+                        buffered_chars += len(content)
+
+                    now = time.monotonic()
+                    if buffer and (buffered_chars >= STREAM_FLUSH_CHARS or now - last_flush >= STREAM_FLUSH_INTERVAL):
+                        yield "".join(buffer)
+                        buffer.clear()
+                        buffered_chars = 0
+                        sent_text = True
+                        last_flush = now
+
+                # Flush whatever is left once the stream ends
+                if buffer:
+                    yield "".join(buffer)
             except Exception as e:
                 logger.error(f"Error in streaming response: {str(e)}")
-                yield f"Error: {str(e)}"
+                # Send any text received before the error, then the error on its own line
+                text = "".join(buffer)
+                separator = "\n" if text or sent_text else ""
+                yield f"{text}{separator}Error: {str(e)}"
+            finally:
+                if next_chunk is not None:
+                    next_chunk.cancel()
+                # Starlette cancels this generator when the client disconnects, so
+                # close the upstream stream here to stop generating (and paying
+                # for) tokens nobody will read
+                if stream is not None:
+                    await stream.close()
+                # A client without the shared pool owns its own connections
+                if shared_http_client is None:
+                    await client.close()
 
         # Return a streaming response to the client
         return StreamingResponse(generate(), media_type="text/plain")
@@ -86,4 +182,6 @@ async def health_check():
 if __name__ == "__main__":
     import uvicorn
     # Start the server on all network interfaces (0.0.0.0) on port 8000
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Cap concurrent connections so long-lived streams can't pile up unbounded;
+    # past the limit uvicorn answers new requests with 503
+    uvicorn.run(app, host="0.0.0.0", port=8000, limit_concurrency=256)